@@ -1,18 +1,30 @@
-from flask import Flask, request, jsonify
-import json
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask.json.provider import JSONProvider
+import hashlib
 import os
+import orjson
+from pathlib import Path
 from flask_cors import CORS
 import google.generativeai as genai
 from openai import OpenAI
 from dotenv import load_dotenv
 import re
-from sqlalchemy import create_engine, Column, Integer, String
-from sqlalchemy.orm import sessionmaker
+import sys
+from sqlalchemy import create_engine, insert, Column, Integer, String, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.declarative import declarative_base
 from email.message import EmailMessage
 import smtplib
+import queue
+import threading
+import time as time_module
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, time
-from pytz import timezone # Import timezone from pytz
+from zoneinfo import ZoneInfo
+import numpy as np
+from cachetools import LRUCache, TTLCache
 
 # Load environment variables from .env file
 load_dotenv()
@@ -20,55 +32,105 @@ load_dotenv()
 # Configure API
 API_PROVIDER = os.getenv('API_PROVIDER', 'gemini') # Default to Gemini
 
+# Kept short since it is sent with every request. The wording for unanswerable questions
+# must keep matching UNANSWERED_PHRASES, which triggers the contact info flow.
+SYSTEM_PROMPT = """You are the Black Belt Test Prep question bank assistant. Answer only from the FAQ JSON below.
+If it doesn't cover the question, politely say you cannot find an answer in the FAQ and suggest they visit the contact page."""
+
 # Configure Generative AI (Gemini)
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 if not GEMINI_API_KEY:
     print("Error: GEMINI_API_KEY not found in .env file.")
-else:
-    genai.configure(api_key=GEMINI_API_KEY)
-    generation_config = {
-        "temperature": 0.5,
-        "top_p": 1,
-        "top_k": 1,
-        "max_output_tokens": 2048,
-    }
-    gemini_model = genai.GenerativeModel(
-        model_name="gemini-2.5-flash-preview-05-20",
-        generation_config=generation_config,
-    )
+generation_config = {
+    "temperature": 0.5,
+    "top_p": 1,
+    "top_k": 1,
+    "max_output_tokens": 2048,
+}
+gemini_model = None
 
 # Configure OpenAI
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 if not OPENAI_API_KEY:
     print("Error: OPENAI_API_KEY not found in .env file.")
-    openai_client = None
-else:
-    openai_client = OpenAI(api_key=OPENAI_API_KEY)
+openai_client = None
+
+# Upper bounds (in seconds) on LLM and embedding API calls. Each call occupies one of the worker's
+# request threads, so a stalled API must not hold it for the SDKs' default of up to ten minutes.
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '60'))
+EMBEDDING_TIMEOUT = float(os.getenv('EMBEDDING_TIMEOUT', '10'))
+
+def configure_llm_clients():
+    """Creates the Gemini model and the OpenAI client for the current process.
+    Called at import and again in each Gunicorn worker after fork (see gunicorn.conf.py),
+    so workers don't share the HTTP connections opened by the preloading master process.
+    """
+    global gemini_model, openai_client
+    if GEMINI_API_KEY:
+        # Set the transport explicitly instead of letting the SDK pick one;
+        # REST, unlike gRPC, is safe to use in processes forked after it was initialized
+        genai.configure(api_key=GEMINI_API_KEY, transport='rest')
+        # The system prompt is set once on the model instead of being prepended to every prompt
+        gemini_model = genai.GenerativeModel(
+            model_name="gemini-2.5-flash-preview-05-20",
+            generation_config=generation_config,
+            system_instruction=SYSTEM_PROMPT,
+        )
+    if OPENAI_API_KEY:
+        openai_client = OpenAI(api_key=OPENAI_API_KEY, timeout=LLM_TIMEOUT)
+
+configure_llm_clients()
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider using orjson, which is faster than the standard library for request and response bodies."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Skip the str round-trip of the default implementation, since orjson produces bytes directly
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype='application/json')
 
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # Database Configuration
 DATABASE_URL = os.getenv('DATABASE_URL')
 if not DATABASE_URL:
-    print("Error: DATABASE_URL not found in .env file.")
-    # Handle this error appropriately, maybe exit or disable email collection
-    # For now, we'll print and proceed, but email saving won't work.
-    db_engine = None
-else:
-    db_engine = create_engine(DATABASE_URL)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
-    Base = declarative_base()
+    # Collected emails are only stored in the database, so refuse to start without it
+    sys.exit("Error: DATABASE_URL not found in .env file.")
+
+# Reuse pooled connections across requests and transparently replace stale ones
+db_engine = create_engine(DATABASE_URL, pool_size=10, max_overflow=20, pool_pre_ping=True)
+Base = declarative_base()
+
+# Define the Email model
+class Email(Base):
+    __tablename__ = "emails"
 
-    # Define the Email model
-    class Email(Base):
-        __tablename__ = "emails"
+    id = Column(Integer, primary_key=True, index=True)
+    email = Column(String, unique=True, index=True)
 
-        id = Column(Integer, primary_key=True, index=True)
-        email = Column(String, unique=True, index=True)
+# Create database tables (if they don't exist)
+Base.metadata.create_all(bind=db_engine)
 
-    # Create database tables (if they don't exist)
-    Base.metadata.create_all(bind=db_engine)
+# Insert an email in a single round-trip, relying on the unique index on emails.email
+# (created by create_all) to reject duplicates instead of checking with a SELECT first.
+if db_engine.dialect.name in ('postgresql', 'sqlite'):
+    dialect_insert = postgresql.insert if db_engine.dialect.name == 'postgresql' else sqlite.insert
+    EMAIL_INSERT = (
+        dialect_insert(Email.__table__)
+        .values(email=bindparam('email'))
+        .on_conflict_do_nothing(index_elements=['email'])
+    )
+else:
+    # Databases without ON CONFLICT raise an IntegrityError for duplicates instead
+    EMAIL_INSERT = insert(Email.__table__).values(email=bindparam('email'))
 
 # Email Configuration
 EMAIL_HOST = os.getenv('EMAIL_HOST')
@@ -81,90 +143,81 @@ SUPPORT_WEBHOOK_URL = os.getenv('SUPPORT_WEBHOOK_URL')
 # Define the path to the faqs.json file (use the corrected path)
 FAQ_FILE_PATH = './faqs.json' # Use the relative path from chatbot/ to the root faqs.json
 
-# In-memory storage for conversation state (for demonstration)
-conversation_state = {}
-
-# Remove file-based email storage
-# In-memory storage for collected emails (for demonstration)
-# In production, use a secure database
-# collected_emails = set()
-# Define a file path for storing emails (for demonstration)
-# EMAIL_STORAGE_FILE = 'collected_emails.txt'
-
-# Remove file-based email loading
-# Load existing emails from file on startup (basic)
-# if os.path.exists(EMAIL_STORAGE_FILE):
-#     with open(EMAIL_STORAGE_FILE, 'r') as f:
-#         for line in f:
-#             collected_emails.add(line.strip())
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# In-memory storage for conversation state, bounded so idle sessions expire instead of leaking memory
+conversation_state = TTLCache(maxsize=10_000, ttl=3600)
+conversation_state_lock = threading.Lock()
 
 def save_email(email: str):
     """Saves an email to the database."""
-    if not db_engine:
-        print("Database engine not configured, cannot save email.")
-        return False
-
-    db = SessionLocal()
     try:
-        # Check if email already exists
-        existing_email = db.query(Email).filter(Email.email == email).first()
-        if existing_email:
-            print(f"Email already collected: {email}")
-            return False # Indicates email was already present
-
-        # Add new email
-        new_email = Email(email=email)
-        db.add(new_email)
-        db.commit()
-        db.refresh(new_email)
-        print(f"Email saved to database: {email}")
-        return True # Indicates a new email was saved
+        with db_engine.begin() as conn:
+            # No row is inserted (rowcount 0) if the email is already present
+            inserted = conn.execute(EMAIL_INSERT, {'email': email}).rowcount > 0
+    except IntegrityError:
+        inserted = False
     except Exception as e:
-        db.rollback()
         print(f"Error saving email to database: {e}")
         return False
-    finally:
-        db.close()
+
+    if not inserted:
+        print(f"Email already collected: {email}")
+        return False # Indicates email was already present
+    print(f"Email saved to database: {email}")
+    return True # Indicates a new email was saved
+
+# Compile the extraction regexes once. Quantifiers are bounded (RFC 5321 length limits)
+# so that long, adversarial inputs cannot trigger excessive backtracking.
+# The lookbehind makes the local part start at its first character, so an over-long
+# address is rejected rather than matched from somewhere in the middle.
+EMAIL_RE = re.compile(r'(?<![a-zA-Z0-9._%+-])[a-zA-Z0-9._%+-]{1,64}@[a-zA-Z0-9.-]{1,253}\.[a-zA-Z]{2,63}')
+URL_RE = re.compile(r'https?://[a-zA-Z0-9.-]{1,253}\.[a-zA-Z]{2,63}[^\s]*')
 
 def extract_email_from_text(text):
     """Searches for and returns the first valid email address found in the text."""
-    # A simple regex to find an email pattern anywhere in the text
-    email_regex = r'[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}'
-    match = re.search(email_regex, text)
+    match = EMAIL_RE.search(text)
     if match:
         return match.group(0)
     return None
 
 def extract_url_from_text(text):
     """Searches for and returns all valid URLs found in the text."""
-    # A regex to find URLs that excludes trailing punctuation commonly found at end of sentences
-    url_regex = r'https?://[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}[^\s]*?(?=[.!?;,]?\s|[.!?;,]?$|$)'
-    urls = re.findall(url_regex, text)
-    # Clean up any trailing punctuation that might still be captured
-    cleaned_urls = []
-    for url in urls:
-        # Remove trailing punctuation
-        url = re.sub(r'[.!?;,]+$', '', url)
-        cleaned_urls.append(url)
-    return cleaned_urls
+    # Remove trailing punctuation commonly found at the end of sentences
+    return [url.rstrip('.!?;,') for url in URL_RE.findall(text)]
+
+NON_WHITESPACE_RE = re.compile(r'\S*')
+
+def extract_answer_urls(answer, known_urls):
+    """Returns all URLs found in an answer, like extract_url_from_text.
+    Known URLs are located with plain substring searches; the regex only runs if the answer contains other URLs.
+    """
+    url_count = answer.count('http://') + answer.count('https://')
+    if not url_count:
+        return []
+    found = []
+    for url in known_urls:
+        start = answer.find(url)
+        while start != -1:
+            end = start + len(url)
+            # Only a complete URL counts, i.e. one followed by nothing but sentence punctuation until whitespace
+            if not NON_WHITESPACE_RE.match(answer, end).group().rstrip('.!?;,'):
+                found.append((start, url))
+            start = answer.find(url, end)
+    if len(found) != url_count:
+        return extract_url_from_text(answer)
+    return [url for _, url in sorted(found)]
+
+# Common short words that are often capitalized at sentence start
+COMMON_WORDS = frozenset({'I', 'A', 'The', 'And', 'Or', 'But', 'For', 'Nor', 'On', 'At', 'To', 'By', 'With'})
+# Capitalized words, skipping the common words above in the same regex pass
+NAME_WORD_RE = re.compile(r'\b(?!(?:%s)\b)[A-Z][a-z]*\b' % '|'.join(sorted(COMMON_WORDS)))
 
 def extract_name_from_text(text):
     """Attempts to extract a name from the text. This is a very basic implementation and might need refinement.
     It looks for capitalized words that are not common English words (e.g., pronouns, prepositions).
     This can be improved with more sophisticated NLP techniques if needed.
     """
-    # Split the text into words and filter for capitalized words
-    words = re.findall(r'\b[A-Z][a-z]*\b', text)
-    # Filter out common short words that are often capitalized at sentence start
-    common_words = {'I', 'A', 'The', 'And', 'Or', 'But', 'For', 'Nor', 'On', 'At', 'To', 'By', 'With'}
-    name_candidates = [word for word in words if word not in common_words]
+    # Capitalized words other than common short words that are often capitalized at sentence start
+    name_candidates = NAME_WORD_RE.findall(text)
     
     # A very simple heuristic: if there are multiple capitalized words, join them as a name.
     # Otherwise, it might be just a capitalized word at the start of a sentence.
@@ -179,95 +232,627 @@ def load_faqs(file_path):
     if not os.path.exists(file_path):
         print(f"Error: FAQ file not found at {file_path}")
         return []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        faqs_data = json.load(f)
+    faqs_data = orjson.loads(Path(file_path).read_bytes())
     return faqs_data.get('faqs', [])
 
-faqs_data = load_faqs(FAQ_FILE_PATH)
+def format_faq(faq):
+    """Formats a single FAQ for the prompt as a compact JSON object."""
+    return orjson.dumps({'q': faq['question'], 'a': faq['answer']}).decode()
 
-def get_answer(query, faqs):
-    """Finds an answer for a given query using the selected LLM and FAQs."""
-    # Format FAQs for the prompt
-    faqs_text = ""
-    for faq in faqs:
-        faqs_text += f"Q: {faq['question']}\nA: {faq['answer']}\n\n"
+def build_user_prompt_prefix(faq_texts):
+    """Builds the part of the user prompt preceding the question from formatted FAQs."""
+    return f"FAQs: [{','.join(faq_texts)}]\nQuestion: "
 
-    # Create the prompt for the LLM
-    prompt = f"""You are a helpful AI assistant for the Black Belt Test Prep question bank. 
-    Your goal is to answer user questions based *only* on the following list of Frequently Asked Questions (FAQs).
-    If a user asks a question that cannot be answered from the provided FAQs, politely state that you cannot find the answer in the FAQ and suggest they visit the contact page.
+PROMPT_SUFFIX = "\nAnswer:"
 
-    Here are the FAQs:
-    {faqs_text}
+# Embedding models used for the semantic cache
+GEMINI_EMBEDDING_MODEL = "models/text-embedding-004"
+OPENAI_EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_BATCH_SIZE = 100 # Gemini's batch embedding limit
 
-    User Question: {query}
-
-    Based *only* on the FAQs provided, please answer the User Question:
-    Chatbot Answer:"""
+# Semantic cache tuning (cosine similarity threshold, entry TTL in seconds, max entries)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0.9'))
+SEMANTIC_CACHE_TTL = int(os.getenv('SEMANTIC_CACHE_TTL', '300'))
+SEMANTIC_CACHE_SIZE = int(os.getenv('SEMANTIC_CACHE_SIZE', '1000'))
 
+def embed_texts(texts):
+    """Returns an L2-normalized embedding matrix (one row per text) using the configured API provider.
+    Returns None if embeddings are unavailable, so callers can fall back to the LLM.
+    """
+    if not texts:
+        return None
     try:
+        vectors = []
         if API_PROVIDER == 'openai':
             if not openai_client:
-                return "Sorry, the chatbot is not configured correctly (OpenAI API key missing)."
+                return None
+            response = openai_client.embeddings.create(
+                model=OPENAI_EMBEDDING_MODEL,
+                input=texts,
+                timeout=EMBEDDING_TIMEOUT,
+            )
+            vectors = [item.embedding for item in response.data]
+        elif API_PROVIDER == 'gemini':
+            if not GEMINI_API_KEY:
+                return None
+            for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+                result = genai.embed_content(
+                    model=GEMINI_EMBEDDING_MODEL,
+                    content=texts[start:start + EMBEDDING_BATCH_SIZE],
+                    task_type="semantic_similarity",
+                    request_options={'timeout': EMBEDDING_TIMEOUT},
+                )
+                vectors.extend(result['embedding'])
+        else:
+            return None
+    except Exception as e:
+        print(f"Error computing embeddings: {e}")
+        return None
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+class SemanticCache:
+    """In-memory cache of LLM answers keyed by query embedding.
+    Lookups return the answer of the most similar cached query if its cosine similarity reaches the threshold.
+    Entries expire after `ttl` seconds and the least recently used entry is evicted once `max_size` is reached.
+    """
+
+    def __init__(self, threshold, ttl, max_size):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Embeddings are stored in a preallocated matrix (created on the first store, once the dimension is known)
+        # whose rows are reused, so storing an answer never reallocates it. Unused rows are zero, which can
+        # never reach the (positive) similarity threshold.
+        self._vectors = None
+        self._rows_used = 0 # Rows past this index have never been used and are skipped by lookups
+        self._free_rows = []
+        self._entries = OrderedDict() # row -> answer, ordered from least to most recently used
+        self._expiry = OrderedDict() # row -> expires_at, in insertion (and therefore expiry) order
+
+    def lookup(self, query_vector):
+        """Returns the cached answer for the closest query, or None on a miss."""
+        with self._lock:
+            self._purge_expired()
+            if not self._entries:
+                return None
+            similarities = self._vectors[:self._rows_used] @ query_vector
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+            self._entries.move_to_end(best)
+            return self._entries[best]
+
+    def store(self, query_vector, answer):
+        """Adds an answer to the cache, evicting the least recently used entry if the cache is full."""
+        with self._lock:
+            self._purge_expired()
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_size, query_vector.shape[0]), dtype=np.float32)
+            if self._free_rows:
+                row = self._free_rows.pop()
+            elif self._rows_used < self.max_size:
+                row = self._rows_used
+                self._rows_used += 1
+            else:
+                row, _ = self._entries.popitem(last=False)
+                del self._expiry[row]
+            self._vectors[row] = query_vector
+            self._entries[row] = answer
+            self._expiry[row] = time_module.monotonic() + self.ttl
+
+    def clear(self):
+        """Removes all cached answers."""
+        with self._lock:
+            self._reset()
+
+    def _purge_expired(self):
+        now = time_module.monotonic()
+        while self._expiry:
+            row, expires_at = next(iter(self._expiry.items()))
+            if expires_at > now:
+                break
+            del self._expiry[row]
+            del self._entries[row]
+            self._vectors[row] = 0
+            self._free_rows.append(row)
+
+semantic_cache = SemanticCache(SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL, SEMANTIC_CACHE_SIZE)
+
+def get_file_mtime(file_path):
+    """Returns the modification time of a file, or None if it doesn't exist."""
+    try:
+        return os.stat(file_path).st_mtime
+    except OSError:
+        return None
+
+def get_file_digest(file_path):
+    """Returns a hash of a file's contents, or None if it can't be read."""
+    try:
+        return hashlib.blake2b(Path(file_path).read_bytes(), digest_size=16).hexdigest()
+    except OSError:
+        return None
+
+NON_ALPHANUMERIC_RE = re.compile(r'[^a-z0-9]+')
+
+def faq_question_key(text):
+    """Normalizes a question for direct FAQ matching (case, whitespace and punctuation insensitive)."""
+    return NON_ALPHANUMERIC_RE.sub(' ', text.lower()).strip()
+
+def build_faq_state(file_path):
+    """Loads the FAQs and precomputes everything derived from them.
+    The static parts of the prompt are built once, since only the user question changes per request,
+    and the FAQ questions are embedded so near-identical questions are answered straight from the FAQ.
+    """
+    mtime = get_file_mtime(file_path)
+    digest = get_file_digest(file_path)
+    faqs = load_faqs(file_path)
+    faq_texts = [format_faq(faq) for faq in faqs]
+    return {
+        'mtime': mtime,
+        'digest': digest,
+        'faqs': faqs,
+        'faq_texts': faq_texts,
+        # Answers by normalized question, so questions asked exactly as in the FAQ skip the embedding and the LLM
+        'answers_by_question': {faq_question_key(faq['question']): faq['answer'] for faq in faqs},
+        'user_prompt_prefix': build_user_prompt_prefix(faq_texts),
+        'vectors': embed_texts([faq['question'] for faq in faqs]),
+        # URLs linked from the FAQ answers, which is where nearly all URLs in the chatbot's answers come from
+        'urls': sorted({url for faq in faqs for url in extract_url_from_text(faq['answer'])}),
+    }
+
+# Number of most relevant FAQs included in the prompt when embeddings are available
+FAQ_TOP_K = int(os.getenv('FAQ_TOP_K', '5'))
+
+def select_faq_indices(state, query_vector):
+    """Returns the indices of the FAQs most similar to the query, or None to use every FAQ
+    (if embeddings are unavailable or there are no more FAQs than FAQ_TOP_K).
+    """
+    if query_vector is None or state['vectors'] is None or len(state['faqs']) <= FAQ_TOP_K:
+        return None
+    similarities = state['vectors'] @ query_vector
+    # Partial selection of the top K is O(n); only those K are then sorted, most similar first
+    top = np.argpartition(-similarities, FAQ_TOP_K - 1)[:FAQ_TOP_K]
+    return top[np.argsort(-similarities[top])].tolist()
+
+def get_user_prompt_prefix(state, query_vector):
+    """Returns the user prompt prefix listing only the FAQs most similar to the query.
+    Falls back to the precomputed prefix listing every FAQ if embeddings are unavailable.
+    """
+    indices = select_faq_indices(state, query_vector)
+    if indices is None:
+        return state['user_prompt_prefix']
+    return build_user_prompt_prefix(state['faq_texts'][i] for i in indices)
+
+# Replaced as a whole when the FAQ file changes, so requests always see a consistent snapshot
+faq_state = build_faq_state(FAQ_FILE_PATH)
+
+# How often (in seconds) to check faqs.json for changes; 0 disables reloading
+FAQ_RELOAD_INTERVAL = int(os.getenv('FAQ_RELOAD_INTERVAL', '30'))
+
+def retry_faq_embeddings():
+    """Embeds the FAQ questions again if that failed when the FAQs were loaded (e.g. an API timeout)."""
+    global faq_state
+    if faq_state['vectors'] is not None or not faq_state['faqs']:
+        return
+    vectors = embed_texts([faq['question'] for faq in faq_state['faqs']])
+    if vectors is not None:
+        faq_state = {**faq_state, 'vectors': vectors}
+        print(f"Embedded {len(faq_state['faqs'])} FAQ questions")
+
+def watch_faq_file():
+    """Reloads the FAQs in the background whenever the FAQ file changes, so requests never pay the reload cost.
+    Also retries the FAQ embeddings if computing them failed, since FAQ matching and retrieval depend on them.
+    """
+    global faq_state
+    while True:
+        time_module.sleep(FAQ_RELOAD_INTERVAL)
+        mtime = get_file_mtime(FAQ_FILE_PATH)
+        if mtime is None or mtime == faq_state['mtime']:
+            retry_faq_embeddings()
+            continue
+        # Touched or rewritten without changes (e.g. by a deploy): keep the FAQ embeddings and cached answers
+        if get_file_digest(FAQ_FILE_PATH) == faq_state['digest']:
+            faq_state = {**faq_state, 'mtime': mtime}
+            retry_faq_embeddings()
+            continue
+        try:
+            new_state = build_faq_state(FAQ_FILE_PATH)
+        except Exception as e:
+            print(f"Error reloading FAQs: {e}")
+            continue
+        faq_state = new_state
+        # Cached answers may be based on outdated FAQs
+        semantic_cache.clear()
+        with exact_cache_lock:
+            exact_cache.clear()
+        print(f"Reloaded {len(new_state['faqs'])} FAQs from {FAQ_FILE_PATH}")
+
+# PID of the process running the FAQ watcher thread
+faq_watcher_pid = None
+faq_watcher_lock = threading.Lock()
+
+@app.before_request
+def ensure_faq_watcher():
+    """Starts the FAQ watcher thread in the current process on its first request.
+    Threads don't survive fork, so it isn't started at import, which happens in the Gunicorn master.
+    """
+    global faq_watcher_pid
+    if FAQ_RELOAD_INTERVAL <= 0 or faq_watcher_pid == os.getpid():
+        return
+    with faq_watcher_lock:
+        if faq_watcher_pid != os.getpid():
+            threading.Thread(target=watch_faq_file, name="faq-watcher", daemon=True).start()
+            faq_watcher_pid = os.getpid()
+
+def find_cached_answer(query_vector):
+    """Returns an FAQ answer or a previously generated answer for a semantically similar query, if any."""
+    if query_vector is None:
+        return None
+    state = faq_state
+    if state['vectors'] is not None:
+        similarities = state['vectors'] @ query_vector
+        best = int(np.argmax(similarities))
+        if similarities[best] >= SEMANTIC_CACHE_THRESHOLD:
+            return state['faqs'][best]['answer']
+    return semantic_cache.lookup(query_vector)
+
+# LLM calls currently in flight, keyed by normalized query, so concurrent duplicate questions share one call
+inflight_calls = {}
+inflight_lock = threading.Lock()
+
+def normalize_query(query):
+    """Normalizes a query for exact-match comparisons (case and whitespace insensitive)."""
+    return " ".join(query.lower().split())
+
+def single_flight(key, func):
+    """Runs func, or waits for the result of an identical call already in flight for the same key."""
+    with inflight_lock:
+        future = inflight_calls.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = Future()
+            inflight_calls[key] = future
+    if not is_owner:
+        return future.result()
+
+    try:
+        result = func()
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with inflight_lock:
+            del inflight_calls[key]
+
+def embed_query(query):
+    """Returns the normalized embedding of a query, or None if embeddings are unavailable."""
+    query_vectors = embed_texts([query])
+    return query_vectors[0] if query_vectors is not None else None
+
+# Answers for exact repeats of a normalized query, checked before computing any embedding
+EXACT_CACHE_SIZE = int(os.getenv('EXACT_CACHE_SIZE', '2048'))
+exact_cache = LRUCache(maxsize=EXACT_CACHE_SIZE)
+exact_cache_lock = threading.Lock()
+
+def lookup_answer(key, query):
+    """Looks up an answer for a query: a direct FAQ question match, then a cached answer
+    by normalized text and finally by embedding similarity.
+    Returns the answer (or None on a miss) and the query embedding, if one was computed.
+    """
+    answer = faq_state['answers_by_question'].get(faq_question_key(query))
+    if answer is not None:
+        return answer, None
 
-            system_prompt = """You are a helpful AI assistant for the Black Belt Test Prep question bank. 
-Your goal is to answer user questions based *only* on the following list of Frequently Asked Questions (FAQs).
-If a user asks a question that cannot be answered from the provided FAQs, politely state that you cannot find the answer in the FAQ and suggest they visit the contact page."""
+    with exact_cache_lock:
+        answer = exact_cache.get(key)
+    if answer is not None:
+        return answer, None
 
-            user_prompt = f"""Here are the FAQs:
-{faqs_text}
+    query_vector = embed_query(query)
+    answer = find_cached_answer(query_vector)
+    if answer is not None:
+        with exact_cache_lock:
+            exact_cache[key] = answer
+    return answer, query_vector
 
-User Question: {query}
+def cache_answer(key, query_vector, answer):
+    """Adds a generated answer to the caches, unless it indicates the question couldn't be answered."""
+    if is_unanswered(answer):
+        return
+    with exact_cache_lock:
+        exact_cache[key] = answer
+    if query_vector is not None:
+        semantic_cache.store(query_vector, answer)
+
+def get_answer(query):
+    """Finds an answer for a given query using the caches, falling back to the selected LLM and FAQs."""
+    key = normalize_query(query)
+    cached_answer, query_vector = lookup_answer(key, query)
+    if cached_answer is not None:
+        return cached_answer
+
+    def generate_and_cache():
+        if LLM_BATCH_SIZE > 1:
+            answer = answer_batcher.submit(query, query_vector)
+        else:
+            answer = generate_answer(query, query_vector)
+        cache_answer(key, query_vector, answer)
+        return answer
+
+    return single_flight(key, generate_and_cache)
+
+def stream_answer(query):
+    """Yields the answer for a given query in chunks as it is generated.
+    A cached answer is yielded as a single chunk.
+    """
+    key = normalize_query(query)
+    cached_answer, query_vector = lookup_answer(key, query)
+    if cached_answer is not None:
+        yield cached_answer
+        return
+
+    chunks = []
+    for chunk in stream_completion(query, query_vector):
+        chunks.append(chunk)
+        yield chunk
+    cache_answer(key, query_vector, "".join(chunks).strip())
+
+def generate_answer(query, query_vector=None):
+    """Generates an answer for a given query using the selected LLM and the FAQs most relevant to it."""
+    return "".join(stream_completion(query, query_vector)).strip()
+
+def stream_completion(query, query_vector=None):
+    """Yields chunks of an answer for a given query as they are generated by the selected LLM,
+    using the FAQs most relevant to it.
+    """
+    # Built with a single join so the multi-KB prefix is copied once
+    user_prompt = "".join((get_user_prompt_prefix(faq_state, query_vector), query, PROMPT_SUFFIX))
+    return stream_llm(user_prompt)
+
+# Answers given in place of the LLM's response when it couldn't be obtained
+OPENAI_KEY_MISSING_MESSAGE = "Sorry, the chatbot is not configured correctly (OpenAI API key missing)."
+GEMINI_KEY_MISSING_MESSAGE = "Sorry, the chatbot is not configured correctly (Gemini API key missing)."
+INVALID_PROVIDER_MESSAGE = "Sorry, the chatbot is not configured with a valid API provider."
+NO_RESPONSE_MESSAGE = "Sorry, I couldn't generate a response at this time."
+LLM_ERROR_MESSAGE = "Sorry, I encountered an error while trying to find an answer."
+LLM_FAILURE_MESSAGES = frozenset({
+    OPENAI_KEY_MISSING_MESSAGE, GEMINI_KEY_MISSING_MESSAGE, INVALID_PROVIDER_MESSAGE, NO_RESPONSE_MESSAGE, LLM_ERROR_MESSAGE
+})
+
+def stream_llm(user_prompt):
+    """Yields chunks of the selected LLM's response to a user prompt (sent with the system prompt) as they are generated."""
+    try:
+        if API_PROVIDER == 'openai':
+            if not openai_client:
+                yield OPENAI_KEY_MISSING_MESSAGE
+                return
 
-Based *only* on the FAQs provided, please answer the User Question:
-Chatbot Answer:"""
-            
             response = openai_client.chat.completions.create(
                 model="gpt-4o-mini",
                 messages=[
-                    {"role": "system", "content": system_prompt},
+                    {"role": "system", "content": SYSTEM_PROMPT},
                     {"role": "user", "content": user_prompt}
-                ]
+                ],
+                stream=True
+            )
+            chunks = (
+                chunk.choices[0].delta.content
+                for chunk in response
+                if chunk.choices and chunk.choices[0].delta.content
             )
-            return response.choices[0].message.content.strip()
-        
+
         elif API_PROVIDER == 'gemini':
             if not GEMINI_API_KEY:
-                return "Sorry, the chatbot is not configured correctly (Gemini API key missing)."
-            response = gemini_model.generate_content(prompt)
-            if response and response.candidates and response.candidates[0].content and response.candidates[0].content.parts:
-                return "".join(part.text for part in response.candidates[0].content.parts)
-            else:
-                return "Sorry, I couldn't generate a response at this time."
+                yield GEMINI_KEY_MISSING_MESSAGE
+                return
+
+            response = gemini_model.generate_content(
+                user_prompt,
+                stream=True,
+                request_options={'timeout': LLM_TIMEOUT},
+            )
+            chunks = (
+                "".join(part.text for part in chunk.candidates[0].content.parts)
+                for chunk in response
+                if chunk.candidates and chunk.candidates[0].content and chunk.candidates[0].content.parts
+            )
 
         else:
-            return "Sorry, the chatbot is not configured with a valid API provider."
+            yield INVALID_PROVIDER_MESSAGE
+            return
+
+        generated = False
+        for chunk in chunks:
+            generated = True
+            yield chunk
+        if not generated:
+            yield NO_RESPONSE_MESSAGE
 
     except Exception as e:
         print(f"Error generating response: {e}")
-        return "Sorry, I encountered an error while trying to find an answer."
+        yield LLM_ERROR_MESSAGE
+
+# Micro-batching of concurrent LLM calls into one multi-question prompt (disabled when LLM_BATCH_SIZE is 1).
+# Batches are sent once LLM_BATCH_SIZE questions are queued or LLM_BATCH_WAIT seconds have passed.
+LLM_BATCH_SIZE = int(os.getenv('LLM_BATCH_SIZE', '1'))
+LLM_BATCH_WAIT = float(os.getenv('LLM_BATCH_WAIT', '0.02'))
+BATCH_ANSWER_RE = re.compile(r'<<A(\d+)>>')
+
+def generate_batch_answers(queries, query_vectors):
+    """Answers several questions with a single LLM call.
+    Returns the answers in order (the same failure message for all if the LLM call failed),
+    or None if the response couldn't be split into one answer per question.
+    """
+    state = faq_state
+    indices = []
+    for query_vector in query_vectors:
+        selected = select_faq_indices(state, query_vector)
+        if selected is None:
+            indices = None
+            break
+        indices.extend(i for i in selected if i not in indices)
+    if indices is None:
+        user_prompt_prefix = state['user_prompt_prefix']
+    else:
+        user_prompt_prefix = build_user_prompt_prefix(state['faq_texts'][i] for i in indices)
+    # build_user_prompt_prefix ends with the label for a single question, which is replaced by a numbered list
+    questions = "\n".join(f"<<Q{n}>> {query}" for n, query in enumerate(queries, 1))
+    user_prompt = (
+        user_prompt_prefix.removesuffix("Question: ")
+        + f"Questions:\n{questions}\n"
+        + "Answer each question separately, starting each answer with its label <<A1>>, <<A2>>, etc.\nAnswers:"
+    )
+    response = "".join(stream_llm(user_prompt))
+    # Asking each question separately would most likely fail the same way
+    if response in LLM_FAILURE_MESSAGES:
+        return [response] * len(queries)
+
+    # Splitting on the labels yields [preamble, number, answer, number, answer, ...]
+    parts = BATCH_ANSWER_RE.split(response)
+    answers = {}
+    for number, answer in zip(parts[1::2], parts[2::2]):
+        answers[int(number)] = answer.strip()
+    if sorted(answers) != list(range(1, len(queries) + 1)):
+        return None
+    return [answers[n] for n in range(1, len(queries) + 1)]
+
+class AnswerBatcher:
+    """Collects questions submitted concurrently from request threads and answers each batch with a single LLM call."""
+
+    def __init__(self, max_size, max_wait):
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None # Threads don't survive fork, so they are started per process on first use
+        self._executor = None
+
+    def submit(self, query, query_vector):
+        """Queues a question and waits for its answer."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((query, query_vector, future))
+        answer = future.result()
+        if answer is None:
+            # The batch couldn't be answered together; every waiter asks its own question, in parallel
+            answer = generate_answer(query, query_vector)
+        return answer
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="llm-batch")
+                threading.Thread(target=self._collect_batches, name="llm-batcher", daemon=True).start()
+                self._pid = os.getpid()
+
+    def _collect_batches(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time_module.monotonic() + self.max_wait
+            while len(batch) < self.max_size:
+                remaining = deadline - time_module.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # Answer in the background so the next batch can be collected during the LLM call
+            self._executor.submit(self._answer_batch, batch)
+
+    def _answer_batch(self, batch):
+        queries = [query for query, _, _ in batch]
+        try:
+            answers = None
+            if len(batch) > 1:
+                answers = generate_batch_answers(queries, [query_vector for _, query_vector, _ in batch])
+                if answers is None:
+                    print(f"Could not split the batched answer for {len(batch)} questions, answering them individually")
+            if answers is None:
+                # None tells the waiting request threads to answer their questions themselves
+                answers = [None] * len(batch)
+        except Exception as e:
+            for _, _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, _, future), answer in zip(batch, answers):
+            future.set_result(answer)
+
+answer_batcher = AnswerBatcher(LLM_BATCH_SIZE, LLM_BATCH_WAIT)
+
+# Phrases in an answer indicating that the chatbot could not find the information
+UNANSWERED_PHRASES = [
+    "cannot find an answer",
+    "couldn't generate a response",
+    "encountered an error",
+    "visit the contact page"
+]
+# One case-insensitive pass over the answer for all phrases, without a lowercased copy
+UNANSWERED_RE = re.compile('|'.join(map(re.escape, UNANSWERED_PHRASES)), re.IGNORECASE)
+
+def is_unanswered(answer):
+    """Checks if the answer indicates an inability to find information, case-insensitively."""
+    return UNANSWERED_RE.search(answer) is not None
+
+# Working hours (Eastern Time): 9 AM - 12 PM and 1 PM - 5:30 PM
+EASTERN_TIME = ZoneInfo('America/New_York')
+MORNING_START = time(9, 0)
+MORNING_END = time(12, 0)
+AFTERNOON_START = time(13, 0)
+AFTERNOON_END = time(17, 30)
 
 def is_working_hours():
     """Checks if the current time is within working hours (9 AM - 12 PM and 1 PM - 5:30 PM ET)."""
-    # Define the Eastern Timezone
-    eastern_time = timezone('America/New_York')
-    now_et = datetime.now(eastern_time)
-    current_time = now_et.time()
-    
-    # Define working hour ranges
-    morning_start = time(9, 0)  # 9:00 AM
-    morning_end = time(12, 0)   # 12:00 PM (noon)
-    afternoon_start = time(13, 0) # 1:00 PM
-    afternoon_end = time(17, 30)  # 5:30 PM
-    
-    # Check if current time is within either range
-    in_morning_hours = morning_start <= current_time <= morning_end
-    in_afternoon_hours = afternoon_start <= current_time <= afternoon_end
-    
-    return in_morning_hours or in_afternoon_hours
+    current_time = datetime.now(EASTERN_TIME).time()
+    return MORNING_START <= current_time <= MORNING_END or AFTERNOON_START <= current_time <= AFTERNOON_END
+
+# Support emails are sent from a single background thread so /ask doesn't wait on SMTP.
+# The thread keeps one SMTP connection open across messages instead of redoing the TLS handshake and login.
+mail_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="support-mail")
+smtp_connection = None # Only used from the mail thread
+
+def get_smtp_connection():
+    """Returns the open SMTP connection, connecting and logging in first if needed."""
+    global smtp_connection
+    if smtp_connection is None:
+        # Use SMTP and starttls for a more common secure connection
+        smtp = smtplib.SMTP(EMAIL_HOST, int(EMAIL_PORT), timeout=30)
+        try:
+            smtp.starttls() # Upgrade the connection to a secure TLS connection
+            smtp.login(EMAIL_USERNAME, EMAIL_PASSWORD)
+        except Exception:
+            # Don't leak the socket if the TLS upgrade or login fails
+            smtp.close()
+            raise
+        smtp_connection = smtp
+    return smtp_connection
+
+def close_smtp_connection():
+    """Closes the SMTP connection, if any, so the next email reconnects."""
+    global smtp_connection
+    if smtp_connection is not None:
+        try:
+            smtp_connection.close()
+        finally:
+            smtp_connection = None
 
 def send_support_email(user_query: str, user_email: str | None = None, user_name: str | None = None):
-    """Saves an email to the database."""
+    """Sends an unanswered question to the support email address.
+    Meant to run on mail_executor, since connecting to the SMTP server can take seconds.
+    """
     if not all([EMAIL_HOST, EMAIL_PORT, EMAIL_USERNAME, EMAIL_PASSWORD]):
         print("Email sending is not fully configured (missing env vars).")
         return
@@ -291,20 +876,133 @@ def send_support_email(user_query: str, user_email: str | None = None, user_name
     msg['To'] = SUPPORT_EMAIL
 
     try:
-        # Ensure port is an integer
-        port = int(EMAIL_PORT)
-        # Use SMTP and starttls for a more common secure connection
-        with smtplib.SMTP(EMAIL_HOST, port) as smtp:
-            smtp.starttls() # Upgrade the connection to a secure TLS connection
-            smtp.login(EMAIL_USERNAME, EMAIL_PASSWORD)
-            smtp.send_message(msg)
+        reused = smtp_connection is not None
+        try:
+            get_smtp_connection().send_message(msg)
+        except (smtplib.SMTPException, OSError):
+            if not reused:
+                raise
+            # The reused connection may have gone stale while idle (a dropped socket, or a
+            # '421 timeout exceeded' reply before the server closes it); retry once on a new one
+            close_smtp_connection()
+            get_smtp_connection().send_message(msg)
         print(f"Support email sent for query: {user_query}")
     except Exception as e:
+        close_smtp_connection()
         print(f"Failed to send support email: {e}")
 
-@app.route('/ask', methods=['POST'])
+CONTACT_REQUEST_MESSAGE = "I cannot find an answer to your question in our FAQs. To forward your question to our support team, please provide your name and email address."
+# Used instead where the question can't be forwarded (requests that don't keep conversation state)
+CONTACT_PAGE_MESSAGE = "I cannot find an answer to your question in our FAQs. Please visit the contact page to reach our support team."
+
+def get_session_context(session_id, refresh=True):
+    """Returns the conversation state for a session.
+    If refresh is set, its expiry is also reset, since the session is continuing the conversation.
+    """
+    with conversation_state_lock:
+        session_context = conversation_state.get(session_id)
+        if session_context is None:
+            return {}
+        if refresh:
+            conversation_state[session_id] = session_context
+        return session_context
+
+def clear_session_context(session_id):
+    """Removes the conversation state for a session, if any."""
+    with conversation_state_lock:
+        conversation_state.pop(session_id, None)
+
+def request_contact_info(session_id, original_query):
+    """Stores the original query and sets the flag to wait for contact info for this session."""
+    with conversation_state_lock:
+        conversation_state[session_id] = {
+            'waiting_for_contact': True,
+            'original_query': original_query
+        }
+
+def wants_event_stream():
+    """Checks if the client explicitly asked for the answer as a Server-Sent Events stream."""
+    return request.accept_mimetypes.best_match(['application/json', 'text/event-stream']) == 'text/event-stream'
+
+def format_event(data, event=None):
+    """Formats a Server-Sent Event carrying JSON data."""
+    event_line = f"event: {event}\n" if event else ""
+    return f"{event_line}data: {orjson.dumps(data).decode()}\n\n"
+
+def stream_events(user_input, session_id, accept_contact=True):
+    """Yields the answer as Server-Sent Events: one event per generated chunk, then an 'end' event with the
+    complete answer and its URLs (or, if the question couldn't be answered, the contact info request,
+    or a pointer to the contact page unless accept_contact is set).
+    """
+    chunks = []
+    for chunk in stream_answer(user_input):
+        chunks.append(chunk)
+        yield format_event({'chunk': chunk})
+
+    answer = "".join(chunks).strip()
+    if is_unanswered(answer):
+        if not accept_contact:
+            yield format_event({'answer': CONTACT_PAGE_MESSAGE, 'urls': []}, event='end')
+            return
+        request_contact_info(session_id, user_input)
+        yield format_event({'answer': CONTACT_REQUEST_MESSAGE, 'urls': []}, event='end')
+    else:
+        yield format_event({'answer': answer, 'urls': extract_answer_urls(answer, faq_state['urls'])}, event='end')
+
+def event_stream_response(events):
+    """Wraps an iterable of formatted events in a Server-Sent Events response."""
+    return Response(events, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+def make_reply(payload, stream):
+    """Returns a complete (not generated) reply as JSON, or as a single 'end' event when streaming."""
+    if stream:
+        return event_stream_response([format_event(payload, event='end')])
+    return jsonify(payload)
+
+def init_worker():
+    """Re-creates per-process resources in a Gunicorn worker forked from the preloaded app."""
+    configure_llm_clients()
+    # Drop pooled connections inherited from the master without closing them for the master
+    db_engine.dispose(close=False)
+
+# How long (in seconds) browsers and proxies may reuse an answer fetched with GET /ask
+ANSWER_CACHE_MAX_AGE = int(os.getenv('ANSWER_CACHE_MAX_AGE', '300'))
+
+def get_answer_etag(query):
+    """Returns an ETag for the answer to a query, which only changes with the query text or the FAQs."""
+    version = f"{normalize_query(query)}\0{faq_state['digest']}"
+    return hashlib.blake2b(version.encode(), digest_size=8).hexdigest()
+
+def set_answer_cache_headers(response, etag):
+    """Marks a (200 or 304) response to a GET request for an answer as cacheable.
+    The ETag is weak: the answer to a query means the same while the FAQs are unchanged, but its text may vary.
+    """
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = f'public, max-age={ANSWER_CACHE_MAX_AGE}'
+    response.vary.add('Accept')
+    return response
+
+# GET requests (with the same parameters in the query string) can be cached by browsers and CDNs.
+# They only answer questions: email addresses and contact details must be POSTed, since GET requests
+# end up in access logs and may be prefetched, and these subscribe the email or forward the question.
+@app.route('/ask', methods=['GET', 'POST'])
 def ask_chatbot():
-    data = request.json
+    if request.method == 'GET':
+        return answer_query(request.args, stream=wants_event_stream(), accept_contact=False)
+    return answer_query(request.json, stream=wants_event_stream())
+
+# EventSource clients can only send GET requests and read event streams, so this endpoint always streams.
+# Like GET /ask it only answers questions; email addresses and contact details must be POSTed to /ask.
+@app.route('/ask_stream', methods=['GET'])
+def ask_chatbot_stream():
+    return answer_query(request.args, stream=True, accept_contact=False)
+
+def answer_query(data, stream, accept_contact=True):
+    """Answers the query in the request data, as JSON or, if stream is set, as Server-Sent Events.
+    Unless accept_contact is set, the conversation state is neither used nor changed: queries containing
+    an email address are rejected instead of subscribing the email, and unanswered questions point to
+    the contact page instead of asking for contact info to forward them.
+    """
     user_input = data.get('query')
     session_id = data.get('session_id', 'default_session') 
 
@@ -317,22 +1015,26 @@ def ask_chatbot():
     print(f"Extracted email: {extracted_email}") # Debug print
 
     # Check if the bot is waiting for contact information for this session
-    session_context = conversation_state.get(session_id, {})
+    # Only requests that can continue the contact flow keep the session's state alive
+    session_context = get_session_context(session_id, refresh=accept_contact)
 
-    if session_context.get('waiting_for_contact'):
+    if not accept_contact and extracted_email:
+        return jsonify({'answer': 'Error: Email addresses and contact details must be sent in a POST request to /ask.'}), 400
+
+    if accept_contact and session_context.get('waiting_for_contact'):
         user_name = extract_name_from_text(user_input)
         user_email = extract_email_from_text(user_input)
 
         if user_name and user_email:
             original_query = session_context.get('original_query', 'N/A')
-            send_support_email(original_query, user_email, user_name)
-            del conversation_state[session_id] # Clear state after sending
-            return jsonify({'answer': "Thank you for providing your information. Your question has been forwarded to info@blackbelttestprep.com, and we will get back to you as soon as possible."})
+            mail_executor.submit(send_support_email, original_query, user_email, user_name)
+            clear_session_context(session_id) # Clear state after sending
+            return make_reply({'answer': "Thank you for providing your information. Your question has been forwarded to info@blackbelttestprep.com, and we will get back to you as soon as possible."}, stream)
         elif "no" in user_input.lower() or "don't want to share" in user_input.lower():
-            del conversation_state[session_id]
-            return jsonify({'answer': "Understood. I cannot forward your question without your contact information."})
+            clear_session_context(session_id)
+            return make_reply({'answer': "Understood. I cannot forward your question without your contact information."}, stream)
         else:
-            return jsonify({'answer': "I still need your name and email to forward your question. Please provide them."})
+            return make_reply({'answer': "I still need your name and email to forward your question. Please provide them."}, stream)
 
     # If no email was extracted in the current turn, or if the email was handled (and returned for subscription),
     # proceed with regular FAQ answering using the LLM.
@@ -340,43 +1042,47 @@ def ask_chatbot():
         if save_email(extracted_email):
             # In a real app, generate a unique code and store it associated with the email
             discount_code = "BBTPOFF5"
-            return jsonify({'answer': f"Thank you for subscribing! Here is your $5 discount code: **{discount_code}**. You can now ask me questions about the FAQs."})
+            return make_reply({'answer': f"Thank you for subscribing! Here is your $5 discount code: **{discount_code}**. You can now ask me questions about the FAQs."}, stream)
         else:
             # Email was already collected, or there was a file saving error
             # If already collected, acknowledge it and let them ask questions.
-            return jsonify({'answer': "It looks like that email has already been subscribed. You can now ask me questions about the FAQs."})
+            return make_reply({'answer': "It looks like that email has already been subscribed. You can now ask me questions about the FAQs."}, stream)
+
+    # Stream the answer as it is generated if the client asked for Server-Sent Events
+    if stream:
+        return event_stream_response(stream_with_context(stream_events(user_input, session_id, accept_contact)))
 
-    answer = get_answer(user_input, faqs_data) # Use the loaded faqs_data and the updated get_answer
+    # Let clients revalidate a previously fetched answer without regenerating it
+    etag = get_answer_etag(user_input) if request.method == 'GET' else None
+    # 'If-None-Match: *' matches any current representation, which an answer not generated yet isn't
+    if etag and not request.if_none_match.star_tag and request.if_none_match.contains_weak(etag):
+        return set_answer_cache_headers(Response(status=304), etag)
+
+    answer = get_answer(user_input)
 
     # Check if the answer indicates an inability to find information
     # and prompt for contact info if so.
-    unanswered_phrases = [
-        "cannot find an answer",
-        "couldn't generate a response",
-        "encountered an error",
-        "visit the contact page"
-    ]
-    
-    # Check if any of the unanswered phrases are in the answer, case-insensitively
-    if any(phrase in answer.lower() for phrase in unanswered_phrases):
-        # Store the original query and set flag to wait for contact info
-        conversation_state[session_id] = {
-            'waiting_for_contact': True,
-            'original_query': user_input
-        }
-        return jsonify({'answer': "I cannot find an answer to your question in our FAQs. To forward your question to our support team, please provide your name and email address."})
+    if is_unanswered(answer):
+        if not accept_contact:
+            return jsonify({'answer': CONTACT_PAGE_MESSAGE})
+        request_contact_info(session_id, user_input)
+        return jsonify({'answer': CONTACT_REQUEST_MESSAGE})
 
     # Extract URLs from the answer
-    urls = extract_url_from_text(answer)
+    urls = extract_answer_urls(answer, faq_state['urls'])
 
     # Return the answer and the extracted URLs
-    return jsonify({'answer': answer, 'urls': urls})
+    response = jsonify({'answer': answer, 'urls': urls})
+    if etag:
+        set_answer_cache_headers(response, etag)
+    return response
 
 @app.route('/')
 def index():
     return "Chatbot backend is running."
 
-# if __name__ == '__main__':
-#     # In a production environment, use a production-ready web server like Gunicorn or uWSGI
-#     # Before deploying, make sure to handle the GOOGLE_API_KEY and email storage securely.
-#     # app.run(debug=True) 
\ No newline at end of file
+# In production the app is served by Gunicorn (see gunicorn.conf.py).
+# The built-in server is only started for local development, when DEV is set.
+if __name__ == '__main__' and os.getenv('DEV'):
+    app.run()
+ 
\ No newline at end of file
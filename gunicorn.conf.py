@@ -0,0 +1,20 @@
+# Gunicorn configuration (loaded automatically from the working directory)
+import os
+
+# A single worker process by default: conversation state (the contact info flow) lives in
+# process memory, so a follow-up message served by another worker would lose it.
+# Only raise this once session state is moved to a shared store; each worker also holds its own DB pool.
+workers = int(os.getenv('GUNICORN_WORKERS', '1'))
+
+# Requests spend most of their time waiting on the LLM API, so scale with threads:
+# they overlap that I/O wait across concurrent users within the single worker
+worker_class = "gthread"
+threads = int(os.getenv('GUNICORN_THREADS', '16'))
+
+# Load the app (FAQs, FAQ embeddings) once in the master process and share it with the workers
+preload_app = True
+
+def post_fork(server, worker):
+    # Network clients and pooled DB connections must not be shared across processes
+    import app
+    app.init_worker()